@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import pandas as pd
 import numpy as np
@@ -9,6 +9,7 @@ import time
 from datetime import datetime
 import io
 import base64
+import functools
 import matplotlib
 matplotlib.use('Agg')  # Use non-interactive backend
 import matplotlib.pyplot as plt
@@ -21,42 +22,104 @@ from hierarchical_clustering import AnomalyPatternClustering, run_clustering_ana
 app = Flask(__name__)
 CORS(app)
 
-# Global variables to store analysis state
-analysis_state = {
-    'status': 'idle',
-    'progress': 0,
-    'current_step': '',
-    'results': None,
-    'error': None
-}
+class AnalysisState:
+    """Analysis progress shared between the request handlers and the background thread"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {
+            'status': 'idle',
+            'progress': 0,
+            'current_step': '',
+            'results': None,
+            'error': None
+        }
+    
+    def update(self, **changes):
+        """Apply several field changes atomically"""
+        with self._lock:
+            self._state.update(changes)
+    
+    def snapshot(self):
+        """Return a consistent copy of the current state"""
+        with self._lock:
+            return dict(self._state)
+    
+    def try_start(self):
+        """Reset the state for a new run unless one is already running"""
+        with self._lock:
+            if self._state['status'] == 'running':
+                return False
+            self._state = {
+                'status': 'running',
+                'progress': 0,
+                'current_step': 'Initializing',
+                'results': None,
+                'error': None
+            }
+            return True
+
+# Global analysis state
+analysis_state = AnalysisState()
+
+# Rows serialized per chunk when streaming CSV downloads
+CSV_CHUNK_ROWS = 100_000
+
+def pearson_correlation(x, y):
+    """Pearson correlation from dot-product sums, avoiding np.corrcoef's 2xN temporaries"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    
+    sum_x = x.sum()
+    sum_y = y.sum()
+    cov = np.dot(x, y) - sum_x * sum_y / n
+    var_x = np.dot(x, x) - sum_x * sum_x / n
+    var_y = np.dot(y, y) - sum_y * sum_y / n
+    
+    return cov / np.sqrt(var_x * var_y)
+
+@functools.lru_cache(maxsize=1)
+def generate_pipeline_data_cached():
+    """Generate the dataset once; later calls return that first run (its timestamps and files) as is"""
+    return generate_pipeline_data()
 
 class AnalysisRunner:
     def __init__(self):
-        self.data = None
+        self._data = None
+        self.plots_cache = None
         self.ocsvm_detector = None
         self.clustering_model = None
+    
+    @property
+    def data(self):
+        return self._data
+    
+    @data.setter
+    def data(self, value):
+        # Rendered plots are stale once the data is replaced
+        self._data = value
+        self.plots_cache = None
         
     def run_complete_analysis(self, config):
         """Run the complete analysis pipeline"""
-        global analysis_state
-        
         try:
-            analysis_state['status'] = 'running'
-            analysis_state['progress'] = 0
-            analysis_state['error'] = None
+            analysis_state.update(status='running', progress=0, error=None)
             
             # Step 1: Generate Data
-            analysis_state['current_step'] = 'Data Generation'
-            analysis_state['progress'] = 10
+            analysis_state.update(current_step='Data Generation', progress=10)
             
             print("Starting data generation...")
-            self.data, data_stats = generate_pipeline_data()
+            self.data, data_stats = generate_pipeline_data_cached()
             
-            analysis_state['progress'] = 25
+            # Correlation and feature code below assumes NaN-free signals
+            if self.data[['pressure_mpa', 'frequency_hz']].isna().any().any():
+                raise ValueError("Generated data contains missing pressure/frequency values")
+            
+            analysis_state.update(progress=25)
             
             # Step 2: One-Class SVM Training
-            analysis_state['current_step'] = 'One-Class SVM Training'
-            analysis_state['progress'] = 30
+            analysis_state.update(current_step='One-Class SVM Training', progress=30)
             
             print("Training One-Class SVM...")
             # Split data for training
@@ -72,19 +135,17 @@ class AnalysisRunner:
             )
             
             self.ocsvm_detector.train(train_data, window_size=config.get('window_size', 400))
-            analysis_state['progress'] = 50
+            analysis_state.update(progress=50)
             
             # Step 3: Anomaly Detection
-            analysis_state['current_step'] = 'Anomaly Detection'
-            analysis_state['progress'] = 55
+            analysis_state.update(current_step='Anomaly Detection', progress=55)
             
             print("Performing anomaly detection...")
             ocsvm_results = self.ocsvm_detector.evaluate(test_data, window_size=config.get('window_size', 400))
-            analysis_state['progress'] = 70
+            analysis_state.update(progress=70)
             
             # Step 4: Hierarchical Clustering
-            analysis_state['current_step'] = 'Hierarchical Clustering'
-            analysis_state['progress'] = 75
+            analysis_state.update(current_step='Hierarchical Clustering', progress=75)
             
             print("Performing hierarchical clustering...")
             self.clustering_model = AnomalyPatternClustering(
@@ -94,23 +155,25 @@ class AnalysisRunner:
             
             self.clustering_model.fit_clustering(self.data)
             fp_reduction = self.clustering_model.calculate_false_positive_reduction(self.data)
-            analysis_state['progress'] = 90
+            analysis_state.update(progress=90)
             
             # Step 5: Multi-source Analysis
-            analysis_state['current_step'] = 'Multi-source Analysis'
-            analysis_state['progress'] = 95
+            analysis_state.update(current_step='Multi-source Analysis', progress=95)
             
             print("Performing multi-source analysis...")
             # Calculate correlation between pressure and frequency
             correlation_analysis = self.perform_multisource_analysis(self.data, config)
             
+            # Count each anomaly type in a single pass
+            type_counts = self.data['anomaly_type'].value_counts()
+            
             # Compile final results
             final_results = {
                 'totalSamples': len(self.data),
-                'normalSamples': len(self.data[self.data['anomaly_type'] == 'normal']),
-                'anomalies': len(self.data[self.data['is_anomaly'] == True]),
-                'trueAnomalies': len(self.data[self.data['anomaly_type'] == 'leak']),
-                'falseAnomalies': len(self.data[self.data['anomaly_type'] == 'operational']),
+                'normalSamples': int(type_counts.get('normal', 0)),
+                'anomalies': int(self.data['is_anomaly'].sum()),
+                'trueAnomalies': int(type_counts.get('leak', 0)),
+                'falseAnomalies': int(type_counts.get('operational', 0)),
                 'precision': ocsvm_results['precision'],
                 'recall': ocsvm_results['recall'],
                 'f1Score': ocsvm_results['f1_score'],
@@ -126,18 +189,18 @@ class AnalysisRunner:
                 }
             }
             
-            analysis_state['results'] = final_results
-            analysis_state['progress'] = 100
-            analysis_state['status'] = 'completed'
-            analysis_state['current_step'] = 'Analysis Complete'
+            analysis_state.update(
+                results=final_results,
+                progress=100,
+                status='completed',
+                current_step='Analysis Complete'
+            )
             
             print("Analysis completed successfully!")
             
         except Exception as e:
             print(f"Analysis failed: {str(e)}")
-            analysis_state['status'] = 'error'
-            analysis_state['error'] = str(e)
-            analysis_state['progress'] = 0
+            analysis_state.update(status='error', error=str(e), progress=0)
     
     def perform_multisource_analysis(self, data, config):
         """Perform multi-source analysis on pressure and frequency data"""
@@ -152,17 +215,20 @@ class AnalysisRunner:
         operational_anomalies_detected = 0
         total_anomaly_groups = 0
         
+        # Population variance of frequency per anomaly type, in a single grouped pass
+        freq_variances = anomaly_data.groupby('anomaly_type', observed=True)['frequency_hz'].var(ddof=0)
+        
         for anomaly_type in ['leak', 'operational']:
-            type_data = anomaly_data[anomaly_data['anomaly_type'] == anomaly_type]
-            if len(type_data) > 0:
-                freq_variance = np.var(type_data['frequency_hz'])
+            if anomaly_type in freq_variances.index:
+                freq_variance = freq_variances[anomaly_type]
                 total_anomaly_groups += 1
                 
                 if anomaly_type == 'operational' and freq_variance > variance_threshold:
                     operational_anomalies_detected += 1
         
         # Calculate overall correlation
-        overall_correlation = np.corrcoef(data['pressure_mpa'], data['frequency_hz'])[0, 1]
+        overall_correlation = pearson_correlation(data['pressure_mpa'].to_numpy(),
+                                                  data['frequency_hz'].to_numpy())
         
         additional_fp_reduction = (operational_anomalies_detected / max(total_anomaly_groups, 1)) * 100
         
@@ -187,8 +253,8 @@ def generate_data_endpoint():
     try:
         config = request.json or {}
         
-        # Generate data with configuration
-        data, stats = generate_pipeline_data()
+        # Reuse the first generated dataset rather than regenerating it per request
+        data, stats = generate_pipeline_data_cached()
         
         # Convert sample data for visualization (first 1000 points)
         sample_data = data.head(1000).to_dict('records')
@@ -209,25 +275,15 @@ def generate_data_endpoint():
 @app.route('/api/start-analysis', methods=['POST'])
 def start_analysis():
     """Start the complete analysis pipeline"""
-    global analysis_state
-    
-    if analysis_state['status'] == 'running':
-        return jsonify({
-            'success': False,
-            'message': 'Analysis already running'
-        }), 400
-    
     try:
         config = request.json or {}
         
-        # Reset state
-        analysis_state = {
-            'status': 'running',
-            'progress': 0,
-            'current_step': 'Initializing',
-            'results': None,
-            'error': None
-        }
+        # Check and reset state in one step so concurrent requests can't both start
+        if not analysis_state.try_start():
+            return jsonify({
+                'success': False,
+                'message': 'Analysis already running'
+            }), 400
         
         # Start analysis in background thread
         thread = threading.Thread(target=runner.run_complete_analysis, args=(config,))
@@ -248,15 +304,16 @@ def start_analysis():
 @app.route('/api/analysis-status', methods=['GET'])
 def get_analysis_status():
     """Get current analysis status"""
-    return jsonify(analysis_state)
+    return jsonify(analysis_state.snapshot())
 
 @app.route('/api/analysis-results', methods=['GET'])
 def get_analysis_results():
     """Get analysis results"""
-    if analysis_state['status'] == 'completed' and analysis_state['results']:
+    state = analysis_state.snapshot()
+    if state['status'] == 'completed' and state['results']:
         return jsonify({
             'success': True,
-            'results': analysis_state['results']
+            'results': state['results']
         })
     else:
         return jsonify({
@@ -268,19 +325,23 @@ def get_analysis_results():
 def download_data():
     """Download generated data as CSV"""
     if runner.data is not None:
-        # Create CSV in memory
-        output = io.StringIO()
-        runner.data.to_csv(output, index=False)
-        output.seek(0)
-        
-        # Convert to bytes
-        csv_data = output.getvalue().encode('utf-8')
-        
-        return send_file(
-            io.BytesIO(csv_data),
+        data = runner.data
+        
+        # Stream the CSV in row chunks instead of building it in memory;
+        # each chunk is written as UTF-8 bytes into a reused buffer
+        def generate_csv():
+            buffer = io.BytesIO()
+            for start in range(0, len(data), CSV_CHUNK_ROWS):
+                buffer.seek(0)
+                buffer.truncate()
+                chunk = data.iloc[start:start + CSV_CHUNK_ROWS]
+                chunk.to_csv(buffer, index=False, header=(start == 0), encoding='utf-8')
+                yield buffer.getvalue()
+        
+        return Response(
+            generate_csv(),
             mimetype='text/csv',
-            as_attachment=True,
-            download_name='pipeline_data.csv'
+            headers={'Content-Disposition': 'attachment; filename=pipeline_data.csv'}
         )
     else:
         return jsonify({
@@ -298,11 +359,19 @@ def get_visualizations():
         }), 404
     
     try:
+        # Plots only depend on the data, so reuse them until it changes
+        data = runner.data
+        if runner.plots_cache is not None:
+            return jsonify({
+                'success': True,
+                'plots': runner.plots_cache
+            })
+        
         # Create visualizations
         plots = {}
         
         # Sample data for plotting (first 1000 points)
-        sample_data = runner.data.head(1000)
+        sample_data = data.head(1000)
         
         # Pressure plot
         plt.figure(figsize=(12, 6))
@@ -325,13 +394,17 @@ def get_visualizations():
         
         # Save plot to base64
         img_buffer = io.BytesIO()
-        plt.savefig(img_buffer, format='png', dpi=150, bbox_inches='tight')
+        plt.savefig(img_buffer, format='png', dpi=100, bbox_inches='tight')
         img_buffer.seek(0)
         pressure_plot = base64.b64encode(img_buffer.getvalue()).decode()
         plt.close()
         
         plots['pressure_plot'] = pressure_plot
         
+        # Skip caching if the data was replaced while rendering
+        if runner.data is data:
+            runner.plots_cache = plots
+        
         return jsonify({
             'success': True,
             'plots': plots
@@ -343,6 +416,18 @@ def get_visualizations():
             'error': str(e)
         }), 500
 
+# Parsed model_config.json, reused while the file's mtime is unchanged
+_model_config_cache = {'mtime': None, 'config': None}
+
+def load_model_config_file(path='model_config.json'):
+    """Load the saved model configuration, re-reading only when the file changes"""
+    mtime = os.stat(path).st_mtime_ns
+    if _model_config_cache['mtime'] != mtime:
+        with open(path, 'r') as f:
+            config = json.load(f)
+        _model_config_cache.update(mtime=mtime, config=config)
+    return _model_config_cache['config']
+
 @app.route('/api/model-config', methods=['POST'])
 def save_model_config():
     """Save model configuration"""
@@ -353,6 +438,9 @@ def save_model_config():
         with open('model_config.json', 'w') as f:
             json.dump(config, f, indent=2)
         
+        # Force a reload even if the write landed within the same mtime tick
+        _model_config_cache['mtime'] = None
+        
         return jsonify({
             'success': True,
             'message': 'Configuration saved successfully'
@@ -369,8 +457,7 @@ def get_model_config():
     """Get current model configuration"""
     try:
         if os.path.exists('model_config.json'):
-            with open('model_config.json', 'r') as f:
-                config = json.load(f)
+            config = load_model_config_file()
         else:
             # Default configuration
             config = {
@@ -1,8 +1,37 @@
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
 import json
+import os
+
+# Anomaly type codes stored in the int8 label array
+ANOMALY_TYPES = ['normal', 'leak', 'operational']
+NORMAL, LEAK, OPERATIONAL = range(len(ANOMALY_TYPES))
+
+def load_pipeline_data(path='pipeline_monitoring_data.csv'):
+    """
+    Load the generated monitoring data. The CSV is parsed once and a binary copy
+    is kept next to it, which later runs load directly while it is newer than the CSV.
+    """
+    cache_path = os.path.splitext(path)[0] + '.pkl'
+    csv_mtime = os.path.getmtime(path)  # Raises FileNotFoundError if the data was never generated
+    
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= csv_mtime:
+        try:
+            return pd.read_pickle(cache_path)
+        except Exception as e:
+            # Truncated or written by another pandas version; rebuild it from the CSV
+            print(f"Ignoring unreadable data cache {cache_path}: {e}")
+    
+    data = pd.read_csv(path, parse_dates=['timestamp'], dtype={
+        'pipeline_id': np.int32,
+        'pressure_mpa': np.float32,
+        'frequency_hz': np.float32,
+        'anomaly_type': 'category'
+    })
+    data.to_pickle(cache_path)
+    
+    return data
 
 def generate_pipeline_data():
     """
@@ -16,51 +45,63 @@ def generate_pipeline_data():
         'duration_hours': 24 * 30,  # 30 days
         'sampling_rate': 2,  # 2 seconds
         'leak_events': 12,
-        'operational_events': 150
+        'operational_events': 150,
+        'seed': 42
     }
     
+    rng = np.random.default_rng(config.get('seed'))
+    
     # Calculate total samples
     total_seconds = config['duration_hours'] * 3600
     total_samples = total_seconds // config['sampling_rate']
     
     print(f"Generating {total_samples:,} samples for {config['num_pipelines']} pipelines")
     
-    # Initialize data structure
-    data = []
+    # Preallocate the combined arrays; each pipeline fills its own slice
+    num_rows = config['num_pipelines'] * total_samples
+    pressure = np.empty(num_rows, dtype=np.float32)  # Single precision is ample for these signals
+    frequency = np.empty(num_rows, dtype=np.float32)
+    labels = np.zeros(num_rows, dtype=bool)
+    types = np.full(num_rows, NORMAL, dtype=np.int8)
     
     # Generate base time series
-    timestamps = [datetime.now() + timedelta(seconds=i * config['sampling_rate']) 
-                 for i in range(total_samples)]
+    timestamps = pd.date_range(start=pd.Timestamp.now(), periods=total_samples,
+                               freq=f"{config['sampling_rate']}s")
+    
+    # Deterministic baseline shared by all pipelines; only the noise differs
+    base_pressure = 2.0
+    time_hours = np.arange(total_samples) * config['sampling_rate'] / 3600.0
+    
+    # Normal pressure with daily and hourly cycles (1.5-2.5 MPa range)
+    base_pressure_curve = (base_pressure +
+                           0.3 * np.sin(2 * np.pi * time_hours / 24) +  # Daily cycle
+                           0.1 * np.sin(2 * np.pi * time_hours / 1))    # Hourly variation
+    
+    # Normal pump frequency (20-30 Hz) with semi-daily cycle
+    base_frequency_curve = 25 + 3 * np.sin(2 * np.pi * time_hours / 12)
+    
+    # Reusable buffer for bulk noise draws
+    noise = np.empty(total_samples)
     
     for pipeline_id in range(1, config['num_pipelines'] + 1):
         print(f"Processing pipeline {pipeline_id}/{config['num_pipelines']}")
         
-        # Generate normal pressure data (1.5-2.5 MPa range)
-        base_pressure = 2.0
-        pressure_data = []
-        frequency_data = []
-        anomaly_labels = []
-        anomaly_types = []
+        # Views into this pipeline's slice of the combined arrays
+        rows = slice((pipeline_id - 1) * total_samples, pipeline_id * total_samples)
+        pressure_data = pressure[rows]
+        frequency_data = frequency[rows]
+        anomaly_labels = labels[rows]
+        anomaly_types = types[rows]
         
-        for i in range(total_samples):
-            time_hours = i * config['sampling_rate'] / 3600
-            
-            # Normal pressure with daily and hourly cycles
-            normal_pressure = (base_pressure + 
-                             0.3 * np.sin(2 * np.pi * time_hours / 24) +  # Daily cycle
-                             0.1 * np.sin(2 * np.pi * time_hours / 1) +   # Hourly variation
-                             0.05 * np.random.normal())  # Random noise
-            
-            # Normal pump frequency (20-30 Hz)
-            normal_frequency = (25 + 
-                              3 * np.sin(2 * np.pi * time_hours / 12) +  # Semi-daily cycle
-                              0.5 * np.random.normal())  # Random noise
-            
-            pressure_data.append(normal_pressure)
-            frequency_data.append(normal_frequency)
-            anomaly_labels.append(False)
-            anomaly_types.append('normal')
-    
+        # Add per-pipeline random noise to the shared baseline
+        rng.standard_normal(out=noise)
+        noise *= 0.05
+        np.add(base_pressure_curve, noise, out=pressure_data)
+        
+        rng.standard_normal(out=noise)
+        noise *= 0.5
+        np.add(base_frequency_curve, noise, out=frequency_data)
+
         # Add leak events (true anomalies)
         leak_events_added = 0
         for _ in range(config['leak_events']):
@@ -68,31 +109,25 @@ def generate_pipeline_data():
                 break
                 
             # Random start time (avoid first and last 2 hours)
-            start_sample = np.random.randint(3600, total_samples - 7200)
-            duration_samples = np.random.randint(900, 3600)  # 30 minutes to 2 hours
+            start_sample = rng.integers(3600, total_samples - 7200)
+            duration_samples = rng.integers(900, 3600)  # 30 minutes to 2 hours
             end_sample = min(start_sample + duration_samples, total_samples)
             
             # Check for overlap with existing anomalies
-            overlap = False
-            for j in range(start_sample, end_sample):
-                if j < len(anomaly_labels) and anomaly_labels[j]:
-                    overlap = True
-                    break
+            overlap = anomaly_labels[start_sample:end_sample].any()
             
             if not overlap:
                 # Simulate gradual pressure drop for leak
-                pressure_drop = 0.3 + np.random.random() * 0.5  # 0.3-0.8 MPa drop
+                pressure_drop = 0.3 + rng.random() * 0.5  # 0.3-0.8 MPa drop
                 
-                for j in range(start_sample, end_sample):
-                    if j < len(pressure_data):
-                        progress = (j - start_sample) / (end_sample - start_sample)
-                        drop_factor = min(1.0, progress * 2)  # Gradual drop
-                        
-                        pressure_data[j] -= pressure_drop * drop_factor
-                        # Add some noise to frequency but keep it relatively stable
-                        frequency_data[j] += np.random.normal(0, 0.3)
-                        anomaly_labels[j] = True
-                        anomaly_types[j] = 'leak'
+                event_length = end_sample - start_sample
+                drop_factor = np.clip(np.linspace(0, 2, event_length, endpoint=False), 0, 1)  # Gradual drop
+                
+                pressure_data[start_sample:end_sample] -= pressure_drop * drop_factor
+                # Add some noise to frequency but keep it relatively stable
+                frequency_data[start_sample:end_sample] += rng.normal(0, 0.3, event_length)
+                anomaly_labels[start_sample:end_sample] = True
+                anomaly_types[start_sample:end_sample] = LEAK
                 
                 leak_events_added += 1
         
@@ -102,45 +137,38 @@ def generate_pipeline_data():
             if operational_events_added >= config['operational_events']:
                 break
                 
-            start_sample = np.random.randint(0, total_samples - 1800)
-            duration_samples = np.random.randint(150, 900)  # 5-30 minutes
+            start_sample = rng.integers(0, total_samples - 1800)
+            duration_samples = rng.integers(150, 900)  # 5-30 minutes
             end_sample = min(start_sample + duration_samples, total_samples)
             
             # Check for overlap with leak events
-            overlap = False
-            for j in range(start_sample, end_sample):
-                if j < len(anomaly_types) and anomaly_types[j] == 'leak':
-                    overlap = True
-                    break
+            overlap = (anomaly_types[start_sample:end_sample] == LEAK).any()
             
             if not overlap:
                 # Simulate operational changes
-                pressure_change = np.random.normal(0, 0.4)  # ±0.4 MPa
-                frequency_change = np.random.normal(0, 5)   # ±5 Hz
+                pressure_change = rng.normal(0, 0.4)  # ±0.4 MPa
+                frequency_change = rng.normal(0, 5)   # ±5 Hz
+                
+                # Only alter samples not already claimed by another event
+                event = slice(start_sample, end_sample)
+                normal_mask = anomaly_types[event] == NORMAL
                 
-                for j in range(start_sample, end_sample):
-                    if j < len(pressure_data) and anomaly_types[j] == 'normal':
-                        pressure_data[j] += pressure_change
-                        frequency_data[j] += frequency_change
-                        anomaly_labels[j] = True
-                        anomaly_types[j] = 'operational'
+                pressure_data[event][normal_mask] += pressure_change
+                frequency_data[event][normal_mask] += frequency_change
+                anomaly_labels[event][normal_mask] = True
+                anomaly_types[event][normal_mask] = OPERATIONAL
                 
                 operational_events_added += 1
-        
-        # Create DataFrame for this pipeline
-        pipeline_data = pd.DataFrame({
-            'timestamp': timestamps,
-            'pipeline_id': pipeline_id,
-            'pressure_mpa': pressure_data,
-            'frequency_hz': frequency_data,
-            'is_anomaly': anomaly_labels,
-            'anomaly_type': anomaly_types
-        })
-        
-        data.append(pipeline_data)
     
     # Combine all pipeline data
-    full_data = pd.concat(data, ignore_index=True)
+    full_data = pd.DataFrame({
+        'timestamp': np.tile(timestamps.values, config['num_pipelines']),
+        'pipeline_id': np.repeat(np.arange(1, config['num_pipelines'] + 1, dtype=np.int32), total_samples),
+        'pressure_mpa': pressure,
+        'frequency_hz': frequency,
+        'is_anomaly': labels,
+        'anomaly_type': pd.Categorical.from_codes(types, categories=ANOMALY_TYPES)
+    })
     
     # Generate statistics
     stats = {
@@ -171,8 +199,11 @@ def generate_pipeline_data():
     # Sample one pipeline for visualization
     sample_pipeline = full_data[full_data['pipeline_id'] == 1].head(10000)
     
+    # Every 5th point is plenty to draw the signal lines at this width
+    line_sample = sample_pipeline.iloc[::5]
+    
     plt.subplot(2, 1, 1)
-    plt.plot(sample_pipeline.index, sample_pipeline['pressure_mpa'], 'b-', linewidth=0.5, alpha=0.7)
+    plt.plot(line_sample.index, line_sample['pressure_mpa'], 'b-', linewidth=0.5, alpha=0.7)
     
     # Highlight anomalies
     leak_indices = sample_pipeline[sample_pipeline['anomaly_type'] == 'leak'].index
@@ -189,14 +220,14 @@ def generate_pipeline_data():
     plt.grid(True, alpha=0.3)
     
     plt.subplot(2, 1, 2)
-    plt.plot(sample_pipeline.index, sample_pipeline['frequency_hz'], 'g-', linewidth=0.5, alpha=0.7)
+    plt.plot(line_sample.index, line_sample['frequency_hz'], 'g-', linewidth=0.5, alpha=0.7)
     plt.ylabel('Pump Frequency (Hz)')
     plt.xlabel('Sample Index')
     plt.title('Pump Frequency Data')
     plt.grid(True, alpha=0.3)
     
     plt.tight_layout()
-    plt.savefig('pipeline_data_visualization.png', dpi=300, bbox_inches='tight')
+    plt.savefig('pipeline_data_visualization.png', dpi=100, bbox_inches='tight')
     plt.show()
     
     return full_data, stats
@@ -1,13 +1,102 @@
 import numpy as np
 import pandas as pd
-from sklearn.cluster import AgglomerativeClustering
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import silhouette_score
 import matplotlib.pyplot as plt
 import seaborn as sns
-from scipy.cluster.hierarchy import dendrogram, linkage
+from scipy.cluster.hierarchy import dendrogram, fcluster, linkage
 from scipy.spatial.distance import pdist
 import joblib
+from generate_pipeline_data import load_pipeline_data
+
+def grouped_gradient(values, starts, ends):
+    """
+    np.gradient applied independently to each contiguous group of values
+    """
+    gradient = np.empty_like(values)
+    gradient[1:-1] = (values[2:] - values[:-2]) / 2
+    
+    # One-sided differences at the group edges
+    gradient[starts] = values[starts + 1] - values[starts]
+    gradient[ends - 1] = values[ends - 1] - values[ends - 2]
+    
+    return gradient
+
+def grouped_anomaly_features(pressure, frequency, sizes):
+    """
+    Compute the anomaly pattern features for contiguous groups of samples
+    using reductions over the group offsets
+    """
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    ends = starts + sizes
+    
+    def group_sum(values):
+        return np.add.reduceat(values, starts)
+    
+    pressure_sum = group_sum(pressure)
+    pressure_mean = pressure_sum / sizes
+    frequency_mean = group_sum(frequency) / sizes
+    pressure_min = np.minimum.reduceat(pressure, starts)
+    pressure_max = np.maximum.reduceat(pressure, starts)
+    
+    # Centered sums for variance and correlation
+    pressure_centered = pressure - np.repeat(pressure_mean, sizes)
+    frequency_centered = frequency - np.repeat(frequency_mean, sizes)
+    pressure_ss = group_sum(pressure_centered * pressure_centered)
+    frequency_ss = group_sum(frequency_centered * frequency_centered)
+    cross_ss = group_sum(pressure_centered * frequency_centered)
+    frequency_var = frequency_ss / sizes
+    
+    # Total pressure variation, ignoring differences across group boundaries
+    pressure_abs_diff = np.empty_like(pressure)
+    pressure_abs_diff[1:] = np.abs(np.diff(pressure))
+    pressure_abs_diff[starts] = 0.0
+    
+    pressure_gradient = grouped_gradient(pressure, starts, ends)
+    frequency_gradient = grouped_gradient(frequency, starts, ends)
+    pressure_gradient_mean = group_sum(pressure_gradient) / sizes
+    pressure_gradient_centered = pressure_gradient - np.repeat(pressure_gradient_mean, sizes)
+    
+    # First position of the minimum within each group
+    positions = np.arange(len(pressure))
+    at_min = pressure == np.repeat(pressure_min, sizes)
+    pressure_argmin = np.minimum.reduceat(np.where(at_min, positions, len(pressure)), starts) - starts
+    
+    # Zero correlation when either signal is constant over the group
+    correlation_denominator = np.sqrt(pressure_ss * frequency_ss)
+    correlation = np.divide(cross_ss, correlation_denominator, out=np.zeros_like(cross_ss),
+                            where=correlation_denominator > 0)
+    
+    # Morphological features
+    return np.column_stack([
+        # Pressure pattern features
+        pressure_mean,
+        np.sqrt(pressure_ss / sizes),
+        pressure_min,
+        pressure_max,
+        pressure_max - pressure_min,  # Peak-to-peak
+        
+        # Frequency pattern features
+        frequency_mean,
+        np.sqrt(frequency_var),
+        frequency_var,
+        
+        # Duration and intensity
+        sizes,  # Duration in samples
+        group_sum(pressure_abs_diff),  # Total pressure variation
+        
+        # Gradient features
+        pressure_gradient_mean,
+        np.sqrt(group_sum(pressure_gradient_centered ** 2) / sizes),
+        group_sum(frequency_gradient) / sizes,
+        
+        # Cross-correlation
+        correlation,
+        
+        # Shape characteristics
+        pressure_sum - (pressure[starts] + pressure[ends - 1]) / 2,  # Area under pressure curve
+        pressure_argmin / sizes,  # Position of minimum
+    ])
 
 class AnomalyPatternClustering:
     """
@@ -20,68 +109,47 @@ class AnomalyPatternClustering:
         self.linkage = linkage
         self.distance_metric = distance_metric
         self.scaler = StandardScaler()
-        self.clustering_model = None
+        self.linkage_matrix = None
         self.is_fitted = False
         
     def extract_anomaly_features(self, anomaly_data):
         """
         Extract features from anomaly patterns
         """
-        features = []
-        
-        for _, group in anomaly_data.groupby('anomaly_group'):
-            if len(group) < 2:
-                continue
-                
-            pressure = group['pressure_mpa'].values
-            frequency = group['frequency_hz'].values
-            
-            # Morphological features
-            feature_vector = [
-                # Pressure pattern features
-                np.mean(pressure),
-                np.std(pressure),
-                np.min(pressure),
-                np.max(pressure),
-                np.ptp(pressure),  # Peak-to-peak
-                
-                # Frequency pattern features
-                np.mean(frequency),
-                np.std(frequency),
-                np.var(frequency),
-                
-                # Duration and intensity
-                len(group),  # Duration in samples
-                np.sum(np.abs(np.diff(pressure))),  # Total pressure variation
-                
-                # Gradient features
-                np.mean(np.gradient(pressure)),
-                np.std(np.gradient(pressure)),
-                np.mean(np.gradient(frequency)),
-                
-                # Cross-correlation
-                np.corrcoef(pressure, frequency)[0, 1] if len(pressure) > 1 else 0,
-                
-                # Shape characteristics
-                np.trapz(pressure),  # Area under pressure curve
-                np.argmin(pressure) / len(pressure) if len(pressure) > 0 else 0,  # Position of minimum
-            ]
-            
-            features.append(feature_vector)
+        if len(anomaly_data) == 0:
+            return np.array([])
         
-        return np.array(features)
+        # Make each group contiguous while keeping its samples in their original order
+        group_ids = anomaly_data['anomaly_group'].to_numpy()
+        order = np.argsort(group_ids, kind='stable')
+        group_ids = group_ids[order]
+        pressure = anomaly_data['pressure_mpa'].to_numpy(dtype=np.float64)[order]
+        frequency = anomaly_data['frequency_hz'].to_numpy(dtype=np.float64)[order]
+        
+        # Keep only groups with at least two samples
+        starts = np.flatnonzero(np.concatenate(([True], group_ids[1:] != group_ids[:-1])))
+        sizes = np.diff(np.append(starts, len(group_ids)))
+        keep = sizes >= 2
+        
+        if not keep.any():
+            return np.array([])
+        
+        rows = np.repeat(keep, sizes)
+        return grouped_anomaly_features(pressure[rows], frequency[rows], sizes[keep])
     
     def identify_anomaly_groups(self, data, min_gap=10):
         """
         Group consecutive anomaly points
         """
-        anomaly_data = data[data['is_anomaly'] == True].copy()
-        anomaly_data = anomaly_data.sort_values('timestamp')
+        anomaly_data = data[data['is_anomaly'] == True].sort_values('timestamp')
         
-        # Identify groups of consecutive anomalies
-        anomaly_data['time_diff'] = anomaly_data['timestamp'].diff().dt.total_seconds()
-        anomaly_data['new_group'] = (anomaly_data['time_diff'] > min_gap) | anomaly_data['time_diff'].isna()
-        anomaly_data['anomaly_group'] = anomaly_data['new_group'].cumsum()
+        # Identify groups of consecutive anomalies: a new group starts after each gap
+        # longer than min_gap (compared as timedelta64, whatever the timestamp unit)
+        timestamps = anomaly_data['timestamp'].to_numpy()
+        new_group = np.empty(len(timestamps), dtype=bool)
+        new_group[:1] = True
+        np.greater(np.diff(timestamps), pd.Timedelta(seconds=min_gap).to_timedelta64(), out=new_group[1:])
+        anomaly_data['anomaly_group'] = np.cumsum(new_group, dtype=np.int32)
         
         return anomaly_data
     
@@ -107,24 +175,26 @@ class AnomalyPatternClustering:
             print("No valid features extracted")
             return self
         
-        # Handle NaN values
-        features = np.nan_to_num(features)
+        # Normalize features; single precision halves the memory of the distance computations
+        features_scaled = self.scaler.fit_transform(features).astype(np.float32, copy=False)
         
-        # Normalize features
-        features_scaled = self.scaler.fit_transform(features)
+        # Perform hierarchical clustering on the condensed distance matrix
+        distances = pdist(features_scaled, metric='euclidean')
+        linkage_matrix = linkage(distances, method=self.linkage)
+        cluster_labels = fcluster(linkage_matrix, t=self.n_clusters, criterion='maxclust') - 1
         
-        # Perform hierarchical clustering
-        self.clustering_model = AgglomerativeClustering(
-            n_clusters=self.n_clusters,
-            linkage=self.linkage
-        )
-        
-        cluster_labels = self.clustering_model.fit_predict(features_scaled)
+        # Map each featured group (two or more samples, sorted by id) to its cluster
+        group_sizes = anomaly_data.groupby('anomaly_group').size()
+        featured_groups = group_sizes.index[group_sizes >= 2]
         
         # Store results
+        self.linkage_matrix = linkage_matrix
+        self.group_sizes = group_sizes
+        self.group_clusters = pd.Series(cluster_labels, index=featured_groups)
         self.features = features
         self.features_scaled = features_scaled
         self.cluster_labels = cluster_labels
+        self.cluster_sizes = np.bincount(cluster_labels, minlength=self.n_clusters)  # Groups per cluster
         self.anomaly_data = anomaly_data
         self.is_fitted = True
         
@@ -149,23 +219,19 @@ class AnomalyPatternClustering:
         # Find which cluster contains most leak events
         leak_groups = self.identify_anomaly_groups(leak_data)
         
-        cluster_leak_counts = {}
-        for cluster_id in range(self.n_clusters):
-            cluster_leak_counts[cluster_id] = 0
-        
-        # Count leak events in each cluster
-        for group_id in leak_groups['anomaly_group'].unique():
-            # Find corresponding cluster for this group
-            group_idx = np.where(self.anomaly_data['anomaly_group'] == group_id)[0]
-            if len(group_idx) > 0:
-                # Find cluster assignment for this group
-                feature_idx = list(self.anomaly_data['anomaly_group'].unique()).index(group_id)
-                if feature_idx < len(self.cluster_labels):
-                    cluster_id = self.cluster_labels[feature_idx]
-                    cluster_leak_counts[cluster_id] += len(group_idx)
+        # Look up the cluster of each leak group that was clustered
+        leak_group_clusters = self.group_clusters.reindex(leak_groups['anomaly_group'].unique()).dropna()
+        
+        # Count leak events (samples) in each cluster
+        leak_counts = np.bincount(
+            leak_group_clusters.to_numpy(dtype=np.int64),
+            weights=self.group_sizes[leak_group_clusters.index].to_numpy(),
+            minlength=self.n_clusters
+        )
+        cluster_leak_counts = {cluster_id: int(count) for cluster_id, count in enumerate(leak_counts)}
         
         # Find cluster with most leak events
-        leak_cluster = max(cluster_leak_counts, key=cluster_leak_counts.get)
+        leak_cluster = int(np.argmax(leak_counts))
         
         print(f"Leak cluster identified: Cluster {leak_cluster}")
         print(f"Leak events per cluster: {cluster_leak_counts}")
@@ -185,8 +251,8 @@ class AnomalyPatternClustering:
             return 0.0
         
         # Count total anomalies and those in leak cluster
-        total_anomaly_groups = len(self.cluster_labels)
-        leak_cluster_groups = np.sum(self.cluster_labels == leak_cluster)
+        total_anomaly_groups = int(self.cluster_sizes.sum())
+        leak_cluster_groups = int(self.cluster_sizes[leak_cluster])
         false_positive_groups = total_anomaly_groups - leak_cluster_groups
         
         false_positive_reduction = (false_positive_groups / total_anomaly_groups) * 100
@@ -209,16 +275,14 @@ class AnomalyPatternClustering:
         
         # Plot 1: Dendrogram
         plt.subplot(2, 2, 1)
-        linkage_matrix = linkage(self.features_scaled, method=self.linkage)
-        dendrogram(linkage_matrix)
+        dendrogram(self.linkage_matrix)
         plt.title('Hierarchical Clustering Dendrogram')
         plt.xlabel('Sample Index')
         plt.ylabel('Distance')
         
         # Plot 2: Cluster distribution
         plt.subplot(2, 2, 2)
-        unique_labels, counts = np.unique(self.cluster_labels, return_counts=True)
-        plt.bar(unique_labels, counts)
+        plt.bar(np.arange(len(self.cluster_sizes)), self.cluster_sizes)
         plt.xlabel('Cluster ID')
         plt.ylabel('Number of Anomaly Groups')
         plt.title('Cluster Size Distribution')
@@ -280,7 +344,7 @@ class AnomalyPatternClustering:
             raise ValueError("No fitted model to save")
         
         model_data = {
-            'clustering_model': self.clustering_model,
+            'linkage_matrix': self.linkage_matrix,
             'scaler': self.scaler,
             'n_clusters': self.n_clusters,
             'linkage': self.linkage,
@@ -302,14 +366,23 @@ def optimize_cluster_number(data, max_clusters=25):
     cluster_range = range(5, max_clusters + 1)
     silhouette_scores = []
     
+    # Features do not depend on the number of clusters, so extract them once
+    clustering = AnomalyPatternClustering()
+    anomaly_data = clustering.identify_anomaly_groups(data)
+    features = clustering.extract_anomaly_features(anomaly_data) if len(anomaly_data) > 0 else np.array([])
+    
+    if len(features) > 0:
+        features_scaled = clustering.scaler.fit_transform(features)
+        
+        # Build the full merge tree once; each cluster count is just a cut of it
+        linkage_matrix = linkage(pdist(features_scaled, metric='euclidean'), method=clustering.linkage)
+    
     for n_clusters in cluster_range:
         print(f"Testing {n_clusters} clusters...")
         
-        clustering = AnomalyPatternClustering(n_clusters=n_clusters)
-        clustering.fit_clustering(data)
-        
-        if clustering.is_fitted and len(clustering.features_scaled) > n_clusters:
-            score = silhouette_score(clustering.features_scaled, clustering.cluster_labels)
+        if len(features) > n_clusters:
+            cluster_labels = fcluster(linkage_matrix, t=n_clusters, criterion='maxclust')
+            score = silhouette_score(features_scaled, cluster_labels) if len(np.unique(cluster_labels)) > 1 else 0
             silhouette_scores.append(score)
         else:
             silhouette_scores.append(0)
@@ -344,8 +417,7 @@ def run_clustering_analysis():
     
     # Load data
     try:
-        data = pd.read_csv('pipeline_monitoring_data.csv')
-        data['timestamp'] = pd.to_datetime(data['timestamp'])
+        data = load_pipeline_data()
         print(f"Loaded {len(data):,} samples")
     except FileNotFoundError:
         print("Error: pipeline_monitoring_data.csv not found. Please run generate_pipeline_data.py first.")
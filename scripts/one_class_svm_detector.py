@@ -1,12 +1,56 @@
 import numpy as np
 import pandas as pd
-from sklearn.svm import OneClassSVM
+from scipy import ndimage, signal
+from sklearn.kernel_approximation import Nystroem
+from sklearn.linear_model import SGDOneClassSVM
+from sklearn.pipeline import make_pipeline
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import classification_report, confusion_matrix
 import matplotlib.pyplot as plt
 import seaborn as sns
 from datetime import datetime
 import joblib
+from joblib import Parallel, delayed
+from generate_pipeline_data import load_pipeline_data
+
+def rolling_sum(values, window_size):
+    """
+    Sum of every full window, from prefix sums
+    """
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    return cumulative[window_size:] - cumulative[:-window_size]
+
+def _window_starts(values, window_size, filtered):
+    # ndimage filters are centred; shift so entry i covers values[i:i + window_size]
+    offset = window_size // 2
+    return filtered[offset:offset + len(values) - window_size + 1]
+
+def rolling_min(values, window_size):
+    """
+    Minimum of every full window
+    """
+    return _window_starts(values, window_size, ndimage.minimum_filter1d(values, window_size))
+
+def rolling_max(values, window_size):
+    """
+    Maximum of every full window
+    """
+    return _window_starts(values, window_size, ndimage.maximum_filter1d(values, window_size))
+
+def rolling_percentile(values, window_size, q):
+    """
+    np.percentile (linear interpolation) of every full window, from rank filters
+    """
+    position = q / 100 * (window_size - 1)
+    lower = int(np.floor(position))
+    upper = int(np.ceil(position))
+    
+    result = _window_starts(values, window_size, ndimage.rank_filter(values, lower, size=window_size))
+    if upper > lower:
+        upper_values = _window_starts(values, window_size, ndimage.rank_filter(values, upper, size=window_size))
+        result = result + (position - lower) * (upper_values - result)
+    
+    return result
 
 class PipelineAnomalyDetector:
     """
@@ -14,10 +58,11 @@ class PipelineAnomalyDetector:
     Based on the research paper methodology
     """
     
-    def __init__(self, kernel='rbf', nu=0.05, gamma='auto'):
+    def __init__(self, kernel='rbf', nu=0.05, gamma='auto', n_components=200):
         self.kernel = kernel
         self.nu = nu
         self.gamma = gamma
+        self.n_components = n_components
         self.scaler = StandardScaler()
         self.model = None
         self.is_trained = False
@@ -28,57 +73,90 @@ class PipelineAnomalyDetector:
         """
         print(f"Creating sliding windows (size={window_size}, step={step_size})")
         
-        windows = []
-        labels = []
+        if len(data) < window_size:
+            return np.array([]), np.array([])
         
-        for i in range(0, len(data) - window_size + 1, step_size):
-            window = data.iloc[i:i+window_size]
-            
-            # Extract features from window
-            features = self.extract_window_features(window)
-            windows.append(features)
-            
-            # Label window as anomaly if any sample in window is anomaly
-            has_anomaly = window['is_anomaly'].any()
-            labels.append(has_anomaly)
+        pressure = data['pressure_mpa'].to_numpy(dtype=np.float64)
+        frequency = data['frequency_hz'].to_numpy(dtype=np.float64)
+        is_anomaly = data['is_anomaly'].to_numpy(dtype=bool)
+        
+        windows = self.compute_window_features(pressure, frequency, window_size)[::step_size]
+        
+        # Label window as anomaly if any sample in window is anomaly
+        labels = rolling_sum(is_anomaly, window_size)[::step_size] > 0
         
-        return np.array(windows), np.array(labels)
+        return windows, labels
     
     def extract_window_features(self, window):
         """
         Extract statistical features from a time window
         """
-        pressure = window['pressure_mpa'].values
-        frequency = window['frequency_hz'].values
+        pressure = window['pressure_mpa'].to_numpy(dtype=np.float64)
+        frequency = window['frequency_hz'].to_numpy(dtype=np.float64)
         
-        features = [
+        return self.compute_window_features(pressure, frequency, len(pressure))[0]
+    
+    def compute_window_features(self, pressure, frequency, window_size):
+        """
+        Extract statistical features for every window of the given size, one row
+        per window start. Uses rolling computations whose cost does not grow with
+        the window size.
+        """
+        # Center on the series mean so the prefix sums stay well conditioned
+        pressure_offset = pressure.mean()
+        frequency_offset = frequency.mean()
+        pressure_centered = pressure - pressure_offset
+        frequency_centered = frequency - frequency_offset
+        
+        pressure_mean = rolling_sum(pressure_centered, window_size) / window_size
+        frequency_mean = rolling_sum(frequency_centered, window_size) / window_size
+        pressure_var = np.maximum(
+            rolling_sum(pressure_centered ** 2, window_size) / window_size - pressure_mean ** 2, 0)
+        frequency_var = np.maximum(
+            rolling_sum(frequency_centered ** 2, window_size) / window_size - frequency_mean ** 2, 0)
+        covariance = (rolling_sum(pressure_centered * frequency_centered, window_size) / window_size
+                      - pressure_mean * frequency_mean)
+        
+        # Least-squares slope against the sample index (same as np.polyfit degree 1)
+        x_centered = np.arange(window_size) - (window_size - 1) / 2
+        slope_denominator = np.dot(x_centered, x_centered)
+        
+        pressure_slope = signal.oaconvolve(pressure_centered, x_centered[::-1], mode='valid') / slope_denominator
+        frequency_slope = signal.oaconvolve(frequency_centered, x_centered[::-1], mode='valid') / slope_denominator
+        
+        # Zero correlation when either signal is constant over the window
+        correlation_denominator = np.sqrt(pressure_var * frequency_var)
+        correlation = np.divide(covariance, correlation_denominator, out=np.zeros_like(covariance),
+                                where=correlation_denominator > 0)
+        
+        features = np.column_stack([
             # Pressure features
-            np.mean(pressure),
-            np.std(pressure),
-            np.min(pressure),
-            np.max(pressure),
-            np.median(pressure),
-            np.percentile(pressure, 25),
-            np.percentile(pressure, 75),
+            pressure_mean + pressure_offset,
+            np.sqrt(pressure_var),
+            rolling_min(pressure, window_size),
+            rolling_max(pressure, window_size),
+            rolling_percentile(pressure, window_size, 50),
+            rolling_percentile(pressure, window_size, 25),
+            rolling_percentile(pressure, window_size, 75),
             
             # Frequency features
-            np.mean(frequency),
-            np.std(frequency),
-            np.min(frequency),
-            np.max(frequency),
-            np.median(frequency),
+            frequency_mean + frequency_offset,
+            np.sqrt(frequency_var),
+            rolling_min(frequency, window_size),
+            rolling_max(frequency, window_size),
+            rolling_percentile(frequency, window_size, 50),
             
             # Trend features
-            np.polyfit(range(len(pressure)), pressure, 1)[0],  # Pressure slope
-            np.polyfit(range(len(frequency)), frequency, 1)[0],  # Frequency slope
+            pressure_slope,
+            frequency_slope,
             
             # Variability features
-            np.var(pressure),
-            np.var(frequency),
+            pressure_var,
+            frequency_var,
             
             # Cross-correlation
-            np.corrcoef(pressure, frequency)[0, 1] if len(pressure) > 1 else 0
-        ]
+            correlation
+        ])
         
         return features
     
@@ -95,17 +173,24 @@ class PipelineAnomalyDetector:
         # Create sliding windows
         X_windows, _ = self.create_sliding_windows(normal_data, window_size)
         
-        # Handle NaN values
-        X_windows = np.nan_to_num(X_windows)
-        
-        # Normalize features
-        X_scaled = self.scaler.fit_transform(X_windows)
-        
-        # Train One-Class SVM
-        self.model = OneClassSVM(
-            kernel=self.kernel,
-            nu=self.nu,
-            gamma=self.gamma
+        # Normalize features; single precision halves memory traffic in the kernel map
+        X_scaled = self.scaler.fit_transform(X_windows).astype(np.float32, copy=False)
+        
+        # Resolve gamma the same way sklearn's OneClassSVM does
+        if self.gamma == 'auto':
+            gamma = 1.0 / X_scaled.shape[1]
+        elif self.gamma == 'scale':
+            gamma = 1.0 / (X_scaled.shape[1] * X_scaled.var())
+        else:
+            gamma = self.gamma
+        
+        # Train One-Class SVM on an explicit (Nystroem) approximation of the kernel
+        # feature map, so fitting and scoring are linear in the number of windows.
+        # degree and coef0 follow OneClassSVM's defaults so poly/sigmoid keep their meaning
+        self.model = make_pipeline(
+            Nystroem(kernel=self.kernel, gamma=gamma, degree=3, coef0=0.0,
+                     n_components=self.n_components, random_state=0),
+            SGDOneClassSVM(nu=self.nu, random_state=0)
         )
         
         print(f"Training on {X_scaled.shape[0]} windows with {X_scaled.shape[1]} features")
@@ -128,11 +213,8 @@ class PipelineAnomalyDetector:
         # Create sliding windows
         X_windows, y_true = self.create_sliding_windows(data, window_size)
         
-        # Handle NaN values
-        X_windows = np.nan_to_num(X_windows)
-        
         # Normalize features
-        X_scaled = self.scaler.transform(X_windows)
+        X_scaled = self.scaler.transform(X_windows).astype(np.float32, copy=False)
         
         # Predict (1 = normal, -1 = anomaly)
         predictions = self.model.predict(X_scaled)
@@ -186,7 +268,8 @@ class PipelineAnomalyDetector:
             'scaler': self.scaler,
             'kernel': self.kernel,
             'nu': self.nu,
-            'gamma': self.gamma
+            'gamma': self.gamma,
+            'n_components': self.n_components
         }
         
         joblib.dump(model_data, filepath)
@@ -203,28 +286,47 @@ class PipelineAnomalyDetector:
         self.kernel = model_data['kernel']
         self.nu = model_data['nu']
         self.gamma = model_data['gamma']
+        self.n_components = model_data.get('n_components', self.n_components)
         self.is_trained = True
         
         print(f"Model loaded from {filepath}")
 
-def run_ocsvm_analysis():
+def _train_eval(window_size, train_data, test_data):
+    """
+    Train and evaluate one detector for a single window size, returning the
+    performance metrics and the trained detector
+    """
+    print(f"\nTesting window size: {window_size} seconds")
+    print("-" * 40)
+    
+    # Initialize detector
+    detector = PipelineAnomalyDetector(kernel='rbf', nu=0.05, gamma='auto')
+    
+    # Train model
+    detector.train(train_data, window_size=window_size)
+    
+    # Evaluate on test data
+    performance = detector.evaluate(test_data, window_size=window_size)
+    performance['window_size'] = window_size
+    return performance, detector
+
+def run_ocsvm_analysis(n_jobs=1):
     """
-    Run the complete One-Class SVM analysis
+    Run the complete One-Class SVM analysis. n_jobs sets how many window sizes
+    are trained at once; each worker holds its own windows and kernel map (several
+    GB on the full data set), so raise it only when memory allows.
     """
     print("Starting One-Class SVM Analysis for Oil Pipeline Anomaly Detection")
     print("=" * 70)
     
     # Load data
     try:
-        data = pd.read_csv('pipeline_monitoring_data.csv')
+        data = load_pipeline_data()
         print(f"Loaded {len(data):,} samples from pipeline data")
     except FileNotFoundError:
         print("Error: pipeline_monitoring_data.csv not found. Please run generate_pipeline_data.py first.")
         return
     
-    # Convert timestamp
-    data['timestamp'] = pd.to_datetime(data['timestamp'])
-    
     # Split data (80% train, 20% test)
     split_point = int(len(data) * 0.8)
     train_data = data[:split_point].copy()
@@ -235,22 +337,13 @@ def run_ocsvm_analysis():
     
     # Test different window sizes (as mentioned in the paper)
     window_sizes = [80, 200, 400, 600, 800, 1000, 1200]
-    results = []
     
-    for window_size in window_sizes:
-        print(f"\nTesting window size: {window_size} seconds")
-        print("-" * 40)
-        
-        # Initialize detector
-        detector = PipelineAnomalyDetector(kernel='rbf', nu=0.05, gamma='auto')
-        
-        # Train model
-        detector.train(train_data, window_size=window_size)
-        
-        # Evaluate on test data
-        performance = detector.evaluate(test_data, window_size=window_size)
-        performance['window_size'] = window_size
-        results.append(performance)
+    # Each window size is an independent model, so they can train in parallel
+    sweep = Parallel(n_jobs=n_jobs, backend='loky')(
+        delayed(_train_eval)(window_size, train_data, test_data) for window_size in window_sizes
+    )
+    results = [performance for performance, _ in sweep]
+    detectors = {window_size: detector for window_size, (_, detector) in zip(window_sizes, sweep)}
     
     # Create results DataFrame
     results_df = pd.DataFrame(results)
@@ -278,13 +371,11 @@ def run_ocsvm_analysis():
     plt.title('Predicted Anomalies by Window Size')
     plt.grid(True, alpha=0.3)
     
-    # Train final model with optimal window size (400s as per paper)
-    print(f"\nTraining final model with optimal window size (400s)")
-    final_detector = PipelineAnomalyDetector(kernel='rbf', nu=0.05, gamma='auto')
-    final_detector.train(train_data, window_size=400)
-    
-    # Final evaluation
-    final_results = final_detector.evaluate(test_data, window_size=400)
+    # Final model with optimal window size (400s as per paper); training is
+    # deterministic, so the model and evaluation from the sweep are reused as is
+    print(f"\nUsing final model with optimal window size (400s)")
+    final_detector = detectors[400]
+    final_results = results[window_sizes.index(400)]
     
     # Save final model
     final_detector.save_model('ocsvm_pipeline_model.pkl')